@@ -7,25 +7,126 @@ Easily customizable for any route via config.env file
 import os
 import sys
 import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import string
+import calendar
 import smtplib
+import socket
 import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from operator import itemgetter
+from email.message import EmailMessage
+from html import escape
+from datetime import date, datetime
+from typing import List, Dict, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 # Load environment variables and configuration
 load_dotenv()  # Load API keys and email settings
 load_dotenv('config.env')  # Load flight configuration
 
+# Name lookup tables, indexed by datetime.weekday() / datetime.month
+_DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+_DAY_ABBRS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTH_NAMES = ('', 'January', 'February', 'March', 'April', 'May', 'June',
+                'July', 'August', 'September', 'October', 'November', 'December')
+_MONTH_ABBRS = ('', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+@lru_cache(maxsize=8)
+def compute_weekend_dates(travel_year: int, start_month: int, end_month: int,
+                          departure_days: Tuple[int, ...], trip_duration: int) -> Tuple[Tuple[date, date], ...]:
+    """(departure, return) date pairs for a config, memoized so the monitor and validator share them"""
+    start_ord = date(travel_year, start_month, 1).toordinal()
+    last_day = calendar.monthrange(travel_year, end_month)[1]
+    end_ord = date(travel_year, end_month, last_day).toordinal()
+    
+    # Offsets from the 1st of the start month to each departure weekday,
+    # so we can stride week by week instead of probing every day
+    start_weekday = date.fromordinal(start_ord).weekday()
+    offsets = sorted((d - start_weekday) % 7 for d in set(departure_days))
+    
+    weekend_trips = []
+    for week_ord in range(start_ord, end_ord + 1, 7):
+        for offset in offsets:
+            departure_ord = week_ord + offset
+            return_ord = departure_ord + trip_duration
+            if return_ord <= end_ord:
+                weekend_trips.append((date.fromordinal(departure_ord), date.fromordinal(return_ord)))
+    
+    return tuple(weekend_trips)
+
 class ConfigurableFlightMonitor:
     """Configurable automated flight monitoring with email reporting"""
     
-    def __init__(self):
+    # Static report head (CSS + summary block), parsed once at class load
+    _REPORT_HEADER = string.Template("""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <style>
+                body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
+                .container { max-width: 800px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+                .header { text-align: center; color: #2c3e50; border-bottom: 3px solid #3498db; padding-bottom: 15px; }
+                .summary { background: #ecf0f1; padding: 15px; border-radius: 5px; margin: 20px 0; }
+                .best-deals { margin: 20px 0; }
+                .deal { background: #e8f5e8; padding: 10px; margin: 5px 0; border-left: 4px solid #27ae60; border-radius: 3px; }
+                .stats { display: flex; justify-content: space-around; margin: 20px 0; }
+                .stat { text-align: center; }
+                .month-analysis { margin: 20px 0; }
+                .month { background: #ffeaa7; padding: 10px; margin: 5px 0; border-radius: 3px; }
+                .footer { text-align: center; color: #7f8c8d; margin-top: 30px; border-top: 1px solid #bdc3c7; padding-top: 15px; }
+                h1, h2 { color: #2c3e50; }
+                .price { font-weight: bold; color: #27ae60; }
+                .airline { color: #3498db; }
+                .direct { color: #e74c3c; font-weight: bold; }
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h1>✈️ Flight Monitor Report</h1>
+                    <h2>$route_title</h2>
+                    <p>$generated_at</p>
+                </div>
+                
+                <div class="summary">
+                    <h2>📊 Executive Summary</h2>
+                    <div class="stats">
+                        <div class="stat">
+                            <h3>$$$price_min</h3>
+                            <p>Best Deal</p>
+                        </div>
+                        <div class="stat">
+                            <h3>$$$price_avg</h3>
+                            <p>Average Price</p>
+                        </div>
+                        <div class="stat">
+                            <h3>$total_options</h3>
+                            <p>Options Found</p>
+                        </div>
+                        <div class="stat">
+                            <h3>$api_calls_used</h3>
+                            <p>API Calls Used</p>
+                        </div>
+                    </div>
+                </div>
+                
+                <div class="best-deals">
+                    <h2>🏆 Top 5 Best Deals</h2>
+        """)
+    
+    def __init__(self, force_refresh: bool = False):
         # API and Email credentials
         self.api_key = os.getenv('SERPAPI_KEY')
         self.email_user = os.getenv('EMAIL_USER')
@@ -35,6 +136,9 @@ class ConfigurableFlightMonitor:
         if not all([self.api_key, self.email_user, self.email_pass, self.email_to]):
             raise ValueError("Missing required environment variables: SERPAPI_KEY, EMAIL_USER, EMAIL_PASS, EMAIL_TO")
         
+        # TLS context for SMTP - loading the CA bundle is costly, so do it once
+        self._ssl_context = ssl.create_default_context()
+        
         # Route configuration from config.env
         self.departure_city = os.getenv('DEPARTURE_CITY', 'Tel Aviv')
         self.departure_code = os.getenv('DEPARTURE_CODE', 'TLV')
@@ -53,103 +157,263 @@ class ConfigurableFlightMonitor:
         self.currency = os.getenv('CURRENCY', 'USD')
         self.adults = int(os.getenv('ADULTS', 1))
         self.api_timeout = int(os.getenv('API_TIMEOUT_SECONDS', 30))
-        
-        # API setup
+        self.max_workers = int(os.getenv('MAX_CONCURRENT_SEARCHES', 8))
+        self.prune_ratio = float(os.getenv('PRUNE_PRICE_RATIO', 0))
+        if self.prune_ratio and self.prune_ratio < 1:
+            # Below 1 even the month holding the cheapest sample would be pruned
+            raise ValueError("PRUNE_PRICE_RATIO must be 0 (off) or at least 1")
+        self.target_price = float(os.getenv('TARGET_PRICE', 0))
+        self.dates_pruned = 0
+        self.target_hit = False
+        self.dates_skipped = 0
+        
+        # API setup - one pooled session so parallel searches reuse connections,
+        # retrying rate limits and transient server errors with backoff
         self.base_url = "https://serpapi.com/search"
+        # Everything but the dates is fixed for the monitor's lifetime
+        self._search_params = {
+            'engine': 'google_flights',
+            'departure_id': self.departure_code,
+            'arrival_id': self.arrival_codes,
+            'currency': self.currency,
+            'hl': 'en',
+            'type': '1',
+            'adults': str(self.adults),
+            'api_key': self.api_key
+        }
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=('GET',), raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
         self.api_calls_used = 0
+        self._api_calls_lock = threading.Lock()
         self.results = []
         
+        # Response cache - repeat searches within the TTL don't spend API quota
+        self.force_refresh = force_refresh
+        self.cache_ttl = float(os.getenv('CACHE_TTL_HOURS', 24)) * 3600
+        self.cache_metrics = {'hits': 0, 'misses': 0, 'writes': 0}
+        self._cache = self._open_cache() if self.cache_ttl > 0 else None
+        self._cache_lock = threading.Lock()
+        
         print(f"🛫 Configured for {self.departure_city} ({self.departure_code}) → {self.arrival_city} ({self.arrival_codes})")
         print(f"📅 Monitoring {self.get_month_name(self.start_month)}-{self.get_month_name(self.end_month)} {self.travel_year}")
         print(f"🗓️  Departure days: {', '.join([self.get_day_name(d) for d in self.departure_days])}")
         print(f"⏱️  Trip duration: {self.trip_duration} days")
     
+    def close(self):
+        """Release the HTTP session and the response cache connection"""
+        self.session.close()
+        if self._cache is not None:
+            self._cache.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
     def get_month_name(self, month_num):
         """Convert month number to name"""
-        months = ['', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        return months[month_num]
+        return _MONTH_ABBRS[month_num]
     
     def get_day_name(self, day_num):
         """Convert day number to name"""
-        days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        return days[day_num]
-        
-    def get_weekend_dates(self) -> List[tuple]:
-        """Get weekend dates based on configuration"""
-        weekend_trips = []
-        current_date = datetime(self.travel_year, self.start_month, 1)
-        end_date = datetime(self.travel_year, self.end_month + 1, 1) - timedelta(days=1)
-        
-        while current_date <= end_date:
-            if current_date.weekday() in self.departure_days:
-                departure = current_date.strftime('%Y-%m-%d')
-                return_date = (current_date + timedelta(days=self.trip_duration)).strftime('%Y-%m-%d')
-                
-                return_datetime = datetime.strptime(return_date, '%Y-%m-%d')
-                if return_datetime.month <= self.end_month:
-                    weekend_trips.append((departure, return_date))
-            
-            current_date += timedelta(days=1)
+        return _DAY_NAMES[day_num]
         
-        return weekend_trips
+    def get_weekend_dates(self) -> Tuple[Tuple[date, date], ...]:
+        """Get (departure, return) weekend dates based on configuration (memoized, read-only)"""
+        return compute_weekend_dates(self.travel_year, self.start_month, self.end_month,
+                                     tuple(self.departure_days), self.trip_duration)
+    
+    def _open_cache(self) -> Optional[sqlite3.Connection]:
+        """Open the response cache, or return None to run without it"""
+        cache_dir = os.path.expanduser(os.getenv('CACHE_DIR', '~/.cache/flight_monitor'))
+        cache = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            cache = sqlite3.connect(os.path.join(cache_dir, 'serpapi.sqlite'), check_same_thread=False)
+            cache.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body TEXT, expires REAL)')
+            # Keys include travel dates, so expired rows are never hit again - purge them
+            cache.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+            cache.commit()
+            return cache
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Response cache unavailable, searching without it: {e}")
+            if cache is not None:
+                cache.close()
+            return None
+    
+    def _cache_key(self, params: Dict) -> str:
+        """Hash search params (minus the API key) into a cache key"""
+        key_params = {k: v for k, v in params.items() if k != 'api_key'}
+        # "CDG,ORY" and "ory, cdg" are the same search - canonicalize airport lists
+        for field in ('departure_id', 'arrival_id'):
+            codes = (code.strip().upper() for code in key_params[field].split(','))
+            key_params[field] = ','.join(sorted(code for code in codes if code))
+        return hashlib.sha1(json.dumps(key_params, sort_keys=True).encode()).hexdigest()
+    
+    def _cache_ttl_for(self, departure_date: str) -> float:
+        """Cache lifetime for a search - fares near departure change much faster"""
+        days_out = (date.fromisoformat(departure_date) - date.today()).days
+        if days_out >= 30:
+            return self.cache_ttl
+        if days_out >= 7:
+            return self.cache_ttl / 4
+        return self.cache_ttl / 24
+    
+    def _cache_get(self, key: str) -> Optional[Dict]:
+        """Return a cached response if it is still fresh"""
+        if self._cache is None or self.force_refresh:
+            return None
+        with self._cache_lock:
+            # A locked or damaged cache is just a miss - the search goes to the API
+            try:
+                row = self._cache.execute('SELECT body, expires FROM responses WHERE key = ?', (key,)).fetchone()
+                if row and time.time() < row[1]:
+                    data = json.loads(row[0])
+                    self.cache_metrics['hits'] += 1
+                    return data
+            except (sqlite3.Error, ValueError):
+                pass
+            self.cache_metrics['misses'] += 1
+        return None
+    
+    def _cache_put(self, key: str, data: Dict, departure_date: str):
+        """Store a successful response in the cache"""
+        if self._cache is None:
+            return
+        expires = time.time() + self._cache_ttl_for(departure_date)
+        # Only the flight lists are ever read back - drop metadata, price insights, airports
+        body = {k: data[k] for k in ('best_flights', 'other_flights') if k in data}
+        with self._cache_lock:
+            # Failing to cache (locked database, full disk) must not fail the search
+            try:
+                self._cache.execute('INSERT OR REPLACE INTO responses (key, body, expires) VALUES (?, ?, ?)',
+                                    (key, json.dumps(body, separators=(',', ':')), expires))
+                self._cache.commit()
+                self.cache_metrics['writes'] += 1
+            except sqlite3.Error:
+                pass
+    
+    def fetch_searches_left(self) -> Optional[int]:
+        """Return the searches left on the SerpApi account (the account endpoint is free)"""
+        try:
+            response = self.session.get('https://serpapi.com/account.json', params={'api_key': self.api_key},
+                                        timeout=self.api_timeout)
+            if response.status_code == 200:
+                return json.loads(response.content).get('total_searches_left')
+        except (requests.RequestException, ValueError):
+            pass
+        return None
     
     def search_flight(self, departure_date: str, return_date: str) -> Optional[Dict]:
         """Search for a single flight"""
-        params = {
-            'engine': 'google_flights',
-            'departure_id': self.departure_code,
-            'arrival_id': self.arrival_codes,
-            'outbound_date': departure_date,
-            'return_date': return_date,
-            'currency': self.currency,
-            'hl': 'en',
-            'type': '1',
-            'adults': str(self.adults),
-            'api_key': self.api_key
-        }
+        params = {**self._search_params, 'outbound_date': departure_date, 'return_date': return_date}
+        
+        cache_key = self._cache_key(params)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
         
         try:
-            response = requests.get(self.base_url, params=params, timeout=self.api_timeout)
-            self.api_calls_used += 1
+            response = self.session.get(self.base_url, params=params, timeout=self.api_timeout)
+            with self._api_calls_lock:
+                self.api_calls_used += 1
             
             if response.status_code == 200:
-                data = response.json()
+                data = json.loads(response.content)
                 if 'error' not in data:
+                    # Only cache responses that actually list flights
+                    if data.get('best_flights') or data.get('other_flights'):
+                        self._cache_put(cache_key, data, departure_date)
                     return data
             return None
-        except Exception:
+        except (requests.RequestException, ValueError):
             return None
     
-    def extract_flight_info(self, search_data: Dict, departure_date: str, return_date: str) -> Optional[Dict]:
+    def extract_flight_info(self, search_data: Dict, departure_date: date, return_date: date) -> Optional[Dict]:
         """Extract best flight from search results"""
-        flights = search_data.get('best_flights', [])
-        if not flights:
-            flights = search_data.get('other_flights', [])
-        
+        flights = search_data.get('best_flights') or search_data.get('other_flights')
         if not flights:
             return None
         
-        best_flight = min(flights, key=lambda x: x.get('price', float('inf')))
+        # best_flights is ranked by Google's overall score, not price, so we still
+        # need the minimum - one pass, skipping options that carry no price
+        best_flight, best_price = None, None
+        for flight in flights:
+            price = flight.get('price')
+            if price is not None and (best_price is None or price < best_price):
+                best_flight, best_price = flight, price
+        
+        # Options without a price can't be compared or booked - don't report them as $0
+        if best_flight is None:
+            return None
         
         flight_segments = best_flight.get('flights', [])
         layovers = best_flight.get('layovers', [])
         carbon_info = best_flight.get('carbon_emissions', {})
         
         return {
-            'departure_date': departure_date,
-            'return_date': return_date,
-            'price': best_flight.get('price', 0),
+            'departure_date': departure_date.isoformat(),
+            'return_date': return_date.isoformat(),
+            'price': best_price,
             'duration_minutes': best_flight.get('total_duration', 0),
             'airline': flight_segments[0].get('airline', 'Unknown') if flight_segments else 'Unknown',
             'direct_flight': len(flight_segments) == 1,
             'layovers': [l.get('id', 'Unknown') for l in layovers],
             'carbon_kg': carbon_info.get('this_flight', 0) / 1000 if carbon_info.get('this_flight') else 0,
-            'departure_day': datetime.strptime(departure_date, '%Y-%m-%d').strftime('%A'),
-            'return_day': datetime.strptime(return_date, '%Y-%m-%d').strftime('%A'),
-            'month': datetime.strptime(departure_date, '%Y-%m-%d').strftime('%B')
+            'departure_day': _DAY_NAMES[departure_date.weekday()],
+            'return_day': _DAY_NAMES[return_date.weekday()],
+            'month': _MONTH_NAMES[departure_date.month]
         }
     
+    def _search_and_extract(self, departure_date: date, return_date: date) -> tuple:
+        """Search one date pair and extract its best flight"""
+        search_result = self.search_flight(departure_date.isoformat(), return_date.isoformat())
+        if not search_result:
+            return False, None
+        return True, self.extract_flight_info(search_result, departure_date, return_date)
+    
+    def _scan_dates(self, executor, date_pairs: List[Tuple[date, date]], results: List[Dict]) -> Dict:
+        """Search date pairs concurrently, printing progress and collecting found flights"""
+        futures = {
+            executor.submit(self._search_and_extract, dep_date, ret_date): (dep_date, ret_date)
+            for dep_date, ret_date in date_pairs
+        }
+        
+        found = {}
+        completed = 0
+        for future in as_completed(futures):
+            # After the target price is hit the queued searches are cancelled, but the
+            # ones already running are billed either way - keep collecting those
+            if future.cancelled():
+                continue
+            completed += 1
+            dep_date, ret_date = futures[future]
+            dep_day = _DAY_ABBRS[dep_date.weekday()]
+            ret_day = _DAY_ABBRS[ret_date.weekday()]
+            
+            print(f"  {completed:2d}/{len(date_pairs)}: {dep_day} {dep_date} → {ret_day} {ret_date}")
+            
+            searched, flight_info = future.result()
+            found[(dep_date, ret_date)] = flight_info
+            if flight_info:
+                results.append(flight_info)
+                print(f"        ✅ ${flight_info['price']} {self.currency} ({flight_info['airline']})")
+                if not self.target_hit and self.target_price and flight_info['price'] <= self.target_price:
+                    # Good enough - stop spending quota on dates not yet started
+                    self.target_hit = True
+                    self.dates_skipped += sum(pending.cancel() for pending in futures)
+                    print(f"        🎯 Target price ${self.target_price:g} reached - stopping scan")
+            elif searched:
+                print(f"        ❌ No flights found")
+            else:
+                print(f"        ❌ Search failed")
+        
+        return found
+    
     def run_complete_scan(self) -> List[Dict]:
         """Run complete weekend scan"""
         print(f"� Starting Automated Flight Scan: {self.departure_city} → {self.arrival_city}")
@@ -163,83 +427,117 @@ class ConfigurableFlightMonitor:
         print(f"🎯 Departure days: {departure_day_names}")
         print(f"⏱️  Trip duration: {self.trip_duration} days")
         
+        searches_left = self.fetch_searches_left()
+        if searches_left is not None:
+            print(f"🔋 SerpApi searches left: {searches_left}")
+            if searches_left < len(weekend_dates):
+                print(f"⚠️  Quota is {len(weekend_dates) - searches_left} searches short of a full scan - uncached dates past it will fail")
+        
         results = []
+        self.dates_pruned = 0
+        self.target_hit = False
+        self.dates_skipped = 0
         
-        for i, (dep_date, ret_date) in enumerate(weekend_dates, 1):
-            dep_day = datetime.strptime(dep_date, '%Y-%m-%d').strftime('%a')
-            ret_day = datetime.strptime(ret_date, '%Y-%m-%d').strftime('%a')
+        # Searches are network-bound, so run them concurrently on the shared session
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = weekend_dates
             
-            print(f"  {i:2d}/{len(weekend_dates)}: {dep_day} {dep_date} → {ret_day} {ret_date}")
-            
-            search_result = self.search_flight(dep_date, ret_date)
+            if self.prune_ratio > 0:
+                # Sample one date per month first, then only search the rest of
+                # the months whose sample came close to the cheapest one
+                by_month = {}
+                for pair in weekend_dates:
+                    by_month.setdefault((pair[0].year, pair[0].month), []).append(pair)
+                
+                print(f"🔎 Sampling one date in each of {len(by_month)} months")
+                samples = self._scan_dates(executor, [pairs[0] for pairs in by_month.values()], results)
+                sample_min = min((info['price'] for info in samples.values() if info and info['price']), default=None)
+                
+                pending = []
+                for pairs in by_month.values():
+                    sample = samples.get(pairs[0])
+                    if sample_min and sample and sample['price'] > self.prune_ratio * sample_min:
+                        self.dates_pruned += len(pairs) - 1
+                    else:
+                        pending.extend(pairs[1:])
+                
+                if not self.target_hit:
+                    print(f"🔎 Searching {len(pending)} remaining dates ({self.dates_pruned} pruned)")
             
-            if search_result:
-                flight_info = self.extract_flight_info(search_result, dep_date, ret_date)
-                if flight_info:
-                    results.append(flight_info)
-                    print(f"        ✅ ${flight_info['price']} {self.currency} ({flight_info['airline']})")
-                else:
-                    print(f"        ❌ No flights found")
+            if self.target_hit:
+                self.dates_skipped += len(pending)
             else:
-                print(f"        ❌ Search failed")
+                self._scan_dates(executor, pending, results)
         
         # Sort by price
-        results.sort(key=lambda x: x['price'])
+        results.sort(key=itemgetter('price'))
         
         print(f"\n📊 Scan Complete:")
         print(f"   API calls used: {self.api_calls_used}")
+        print(f"   Cache hits/misses: {self.cache_metrics['hits']}/{self.cache_metrics['misses']}")
+        if self.prune_ratio > 0:
+            print(f"   Dates pruned: {self.dates_pruned}")
+        if self.target_hit:
+            print(f"   Stopped early: target price ${self.target_price:g} reached ({self.dates_skipped} searches skipped)")
         print(f"   Flight options found: {len(results)}")
         
         self.results = results
         return results
     
     def analyze_results(self, results: List[Dict]) -> Dict:
-        """Analyze flight results for insights"""
+        """Analyze flight results for insights (results must be sorted by price)"""
         if not results:
             return {}
         
-        prices = [r['price'] for r in results]
+        # One pass over the price-sorted results builds every bucket; the first
+        # result seen for a month is that month's best deal
+        price_total = 0
+        month_counts, month_totals, month_best = defaultdict(int), defaultdict(int), {}
+        day_counts, day_totals = defaultdict(int), defaultdict(int)
+        for result in results:
+            price = result['price']
+            month = result['month']
+            day = result['departure_day']
+            price_total += price
+            month_counts[month] += 1
+            month_totals[month] += price
+            month_best.setdefault(month, result)
+            day_counts[day] += 1
+            day_totals[day] += price
+        
+        # Basic statistics - results are sorted, so the median is read by position
+        # (averaging the two middle prices when the count is even)
+        mid = len(results) // 2
+        if len(results) % 2:
+            price_median = results[mid]['price']
+        else:
+            price_median = (results[mid - 1]['price'] + results[mid]['price']) / 2
         
-        # Basic statistics
         analysis = {
             'total_options': len(results),
-            'price_min': min(prices),
-            'price_max': max(prices),
-            'price_avg': sum(prices) // len(prices),
-            'price_median': sorted(prices)[len(prices)//2],
+            'price_min': results[0]['price'],
+            'price_max': results[-1]['price'],
+            'price_avg': round(price_total / len(results)),
+            'price_median': price_median,
             'api_calls_used': self.api_calls_used
         }
         
         # By month analysis
-        by_month = {}
-        for result in results:
-            month = result['month']
-            if month not in by_month:
-                by_month[month] = []
-            by_month[month].append(result['price'])
-        
         analysis['by_month'] = {}
-        for month, month_prices in by_month.items():
+        for month, best_deal in month_best.items():
             analysis['by_month'][month] = {
-                'count': len(month_prices),
-                'min_price': min(month_prices),
-                'avg_price': sum(month_prices) // len(month_prices),
-                'best_deal': min(results, key=lambda x: x['price'] if x['month'] == month else float('inf'))
+                'count': month_counts[month],
+                'min_price': best_deal['price'],
+                'avg_price': round(month_totals[month] / month_counts[month]),
+                'best_deal': best_deal
             }
         
         # Day of week analysis
-        by_day = {}
-        for result in results:
-            day = result['departure_day']
-            if day not in by_day:
-                by_day[day] = []
-            by_day[day].append(result['price'])
-        
         analysis['by_day'] = {}
-        for day, day_prices in by_day.items():
+        for day, count in day_counts.items():
             analysis['by_day'][day] = {
-                'count': len(day_prices),
-                'avg_price': sum(day_prices) // len(day_prices)
+                'count': count,
+                'avg_price': round(day_totals[day] / count)
             }
         
         # Find best deals
@@ -251,102 +549,58 @@ class ConfigurableFlightMonitor:
     def generate_email_report(self, results: List[Dict], analysis: Dict) -> str:
         """Generate HTML email report"""
         now = datetime.now()
-        route_title = f"{self.departure_city} → {self.arrival_city}"
+        # City names come from config and airlines from the API, so escape them
+        route_title = escape(f"{self.departure_city} → {self.arrival_city}")
+        currency = escape(self.currency)
         period_text = f"{self.get_month_name(self.start_month)}-{self.get_month_name(self.end_month)} {self.travel_year}"
         departure_days_text = ', '.join([self.get_day_name(d) for d in self.departure_days])
-        
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }}
-                .container {{ max-width: 800px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-                .header {{ text-align: center; color: #2c3e50; border-bottom: 3px solid #3498db; padding-bottom: 15px; }}
-                .summary {{ background: #ecf0f1; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-                .best-deals {{ margin: 20px 0; }}
-                .deal {{ background: #e8f5e8; padding: 10px; margin: 5px 0; border-left: 4px solid #27ae60; border-radius: 3px; }}
-                .stats {{ display: flex; justify-content: space-around; margin: 20px 0; }}
-                .stat {{ text-align: center; }}
-                .month-analysis {{ margin: 20px 0; }}
-                .month {{ background: #ffeaa7; padding: 10px; margin: 5px 0; border-radius: 3px; }}
-                .footer {{ text-align: center; color: #7f8c8d; margin-top: 30px; border-top: 1px solid #bdc3c7; padding-top: 15px; }}
-                h1, h2 {{ color: #2c3e50; }}
-                .price {{ font-weight: bold; color: #27ae60; }}
-                .airline {{ color: #3498db; }}
-                .direct {{ color: #e74c3c; font-weight: bold; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>✈️ Flight Monitor Report</h1>
-                    <h2>{route_title}</h2>
-                    <p>{now.strftime('%B %d, %Y at %H:%M UTC')}</p>
-                </div>
-                
-                <div class="summary">
-                    <h2>📊 Executive Summary</h2>
-                    <div class="stats">
-                        <div class="stat">
-                            <h3>${analysis.get('price_min', 0)}</h3>
-                            <p>Best Deal</p>
-                        </div>
-                        <div class="stat">
-                            <h3>${analysis.get('price_avg', 0)}</h3>
-                            <p>Average Price</p>
-                        </div>
-                        <div class="stat">
-                            <h3>{analysis.get('total_options', 0)}</h3>
-                            <p>Options Found</p>
-                        </div>
-                        <div class="stat">
-                            <h3>{analysis.get('api_calls_used', 0)}</h3>
-                            <p>API Calls Used</p>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="best-deals">
-                    <h2>🏆 Top 5 Best Deals</h2>
-        """
+        # by_month is filled in price order, so its first month holds the cheapest deal
+        best_month = next(iter(analysis.get('by_month', {})), 'N/A')
+        
+        parts = [self._REPORT_HEADER.substitute(
+            route_title=route_title,
+            generated_at=now.strftime('%B %d, %Y at %H:%M UTC'),
+            price_min=analysis.get('price_min', 0),
+            price_avg=analysis.get('price_avg', 0),
+            total_options=analysis.get('total_options', 0),
+            api_calls_used=analysis.get('api_calls_used', 0)
+        )]
         
         for i, deal in enumerate(analysis.get('best_deals', [])[:5], 1):
             duration_hours = deal['duration_minutes'] // 60
             duration_mins = deal['duration_minutes'] % 60
-            direct_text = "Direct" if deal['direct_flight'] else f"Via {', '.join(deal['layovers'])}"
+            direct_text = "Direct" if deal['direct_flight'] else f"Via {escape(', '.join(deal['layovers']))}"
             
-            html += f"""
+            parts.append(f"""
                     <div class="deal">
-                        <strong>#{i}. <span class="price">${deal['price']} {self.currency}</span></strong> - 
-                        <span class="airline">{deal['airline']}</span><br>
+                        <strong>#{i}. <span class="price">${deal['price']} {currency}</span></strong> - 
+                        <span class="airline">{escape(deal['airline'])}</span><br>
                         📅 {deal['departure_day']} {deal['departure_date']} → {deal['return_day']} {deal['return_date']}<br>
                         ✈️ {duration_hours}h {duration_mins}m | <span class="direct">{direct_text}</span> | 
                         🌱 {deal['carbon_kg']:.1f}kg CO₂
                     </div>
-            """
+            """)
         
-        html += """
+        parts.append("""
                 </div>
                 
                 <div class="month-analysis">
                     <h2>📅 Monthly Breakdown</h2>
-        """
+        """)
         
         for month, data in analysis.get('by_month', {}).items():
             best_deal = data['best_deal']
-            html += f"""
+            parts.append(f"""
                     <div class="month">
                         <strong>{month}</strong>: {data['count']} options | 
-                        From <span class="price">${data['min_price']} {self.currency}</span> | 
-                        Avg: ${data['avg_price']} {self.currency}<br>
+                        From <span class="price">${data['min_price']} {currency}</span> | 
+                        Avg: ${data['avg_price']} {currency}<br>
                         🏆 Best: {best_deal['departure_day']} {best_deal['departure_date']} - 
-                        <span class="price">${best_deal['price']} {self.currency}</span> ({best_deal['airline']})
+                        <span class="price">${best_deal['price']} {currency}</span> ({escape(best_deal['airline'])})
                     </div>
-            """
+            """)
         
-        html += f"""
+        parts.append(f"""
                 </div>
                 
                 <div class="summary">
@@ -356,9 +610,9 @@ class ConfigurableFlightMonitor:
                         <li><strong>Period:</strong> {period_text}</li>
                         <li><strong>Departure Days:</strong> {departure_days_text}</li>
                         <li><strong>Trip Duration:</strong> {self.trip_duration} days</li>
-                        <li><strong>Price Range:</strong> ${analysis.get('price_min', 0)} - ${analysis.get('price_max', 0)} {self.currency} (${analysis.get('price_max', 0) - analysis.get('price_min', 0)} spread)</li>
+                        <li><strong>Price Range:</strong> ${analysis.get('price_min', 0)} - ${analysis.get('price_max', 0)} {currency} (${analysis.get('price_max', 0) - analysis.get('price_min', 0)} spread)</li>
                         <li><strong>Direct Flights:</strong> {len(analysis.get('direct_flights', []))} out of {analysis.get('total_options', 0)} options</li>
-                        <li><strong>Best Month:</strong> {min(analysis.get('by_month', {}).items(), key=lambda x: x[1]['min_price'])[0] if analysis.get('by_month') else 'N/A'}</li>
+                        <li><strong>Best Month:</strong> {best_month}</li>
                     </ul>
                 </div>
                 
@@ -369,73 +623,50 @@ class ConfigurableFlightMonitor:
             </div>
         </body>
         </html>
-        """
+        """)
         
-        return html
+        return ''.join(parts)
     
-    def send_email_report(self, results: List[Dict], analysis: Dict):
-        """Send email report with results"""
+    def _smtp_send_with_retry(self, msg, retries: int = 3):
+        """Send a message over one SMTP_SSL session, reconnecting on transient failures"""
+        server = None
+        
         try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            route_text = f"{self.departure_city} → {self.arrival_city}"
-            msg['Subject'] = f"{self.email_subject_prefix} - {route_text} - Best: ${analysis.get('price_min', 0)} {self.currency} - {datetime.now().strftime('%b %d')}"
-            msg['From'] = self.email_user
-            msg['To'] = self.email_to
-            
-            # Generate HTML report
-            html_content = self.generate_email_report(results, analysis)
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            # Add JSON attachment with raw data
-            json_data = {
-                'scan_date': datetime.now().isoformat(),
-                'route': {
-                    'departure_city': self.departure_city,
-                    'departure_code': self.departure_code,
-                    'arrival_city': self.arrival_city,
-                    'arrival_codes': self.arrival_codes
-                },
-                'configuration': {
-                    'travel_year': self.travel_year,
-                    'start_month': self.start_month,
-                    'end_month': self.end_month,
-                    'departure_days': self.departure_days,
-                    'trip_duration': self.trip_duration,
-                    'currency': self.currency
-                },
-                'analysis': analysis,
-                'all_results': results
-            }
-            
-            json_attachment = MIMEBase('application', 'octet-stream')
-            json_attachment.set_payload(json.dumps(json_data, indent=2).encode())
-            encoders.encode_base64(json_attachment)
-            json_attachment.add_header(
-                'Content-Disposition',
-                f'attachment; filename="flight_data_{datetime.now().strftime("%Y%m%d_%H%M")}.json"'
-            )
-            msg.attach(json_attachment)
-            
-            # Send email
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-                server.login(self.email_user, self.email_pass)
-                server.sendmail(self.email_user, self.email_to, msg.as_string())
-            
-            print("✅ Email report sent successfully")
+            for attempt in range(retries):
+                try:
+                    if server is None:
+                        server = smtplib.SMTP_SSL("smtp.gmail.com", 465, context=self._ssl_context)
+                        server.login(self.email_user, self.email_pass)
+                    server.send_message(msg)
+                    break
+                except smtplib.SMTPResponseException as e:
+                    # 4xx replies are temporary; anything else (e.g. bad credentials) won't improve
+                    if not 400 <= e.smtp_code < 500 or attempt == retries - 1:
+                        raise
+                except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                    # socket.timeout only became an alias of TimeoutError in Python 3.10
+                    if attempt == retries - 1:
+                        raise
+                
+                # Drop the broken session and back off before reconnecting
+                if server is not None:
+                    server.close()
+                    server = None
+                print(f"⚠️  Email send failed, retrying in {2 ** attempt}s...")
+                time.sleep(2 ** attempt)
             
-        except Exception as e:
-            print(f"❌ Failed to send email: {e}")
+            # The message is already accepted - a failed QUIT must not trigger a resend
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        finally:
+            if server is not None:
+                server.close()
     
-    def save_local_backup(self, results: List[Dict], analysis: Dict):
-        """Save results locally as backup"""
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        route_slug = f"{self.departure_code}_{self.arrival_codes.replace(',', '_')}"
-        filename = f"flight_monitor_{route_slug}_{timestamp}.json"
-        
-        backup_data = {
+    def build_payload(self, results: List[Dict], analysis: Dict) -> bytes:
+        """Serialize scan data once for both the email attachment and the local backup"""
+        payload = {
             'scan_date': datetime.now().isoformat(),
             'route': {
                 'departure_city': self.departure_city,
@@ -458,50 +689,98 @@ class ConfigurableFlightMonitor:
             'metadata': {
                 'api_calls_used': self.api_calls_used,
                 'scan_type': 'configurable_weekend_monitor',
-                'total_possible_dates': len(self.get_weekend_dates())
+                'total_possible_dates': len(self.get_weekend_dates()),
+                'dates_pruned': self.dates_pruned,
+                'target_price_hit': self.target_hit,
+                'dates_skipped': self.dates_skipped
             }
         }
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    
+    def send_email_report(self, results: List[Dict], analysis: Dict, payload: bytes):
+        """Send email report with results"""
+        try:
+            # Create message
+            msg = EmailMessage()
+            route_text = f"{self.departure_city} → {self.arrival_city}"
+            msg['Subject'] = f"{self.email_subject_prefix} - {route_text} - Best: ${analysis.get('price_min', 0)} {self.currency} - {datetime.now().strftime('%b %d')}"
+            msg['From'] = self.email_user
+            msg['To'] = self.email_to
+            
+            # Generate HTML report
+            html_content = self.generate_email_report(results, analysis)
+            msg.set_content(html_content, subtype='html')
+            
+            # Add JSON attachment with raw data
+            msg.add_attachment(
+                payload,
+                maintype='application',
+                subtype='json',
+                filename=f"flight_data_{datetime.now().strftime('%Y%m%d_%H%M')}.json"
+            )
+            
+            # Send email
+            self._smtp_send_with_retry(msg)
+            
+            print("✅ Email report sent successfully")
+            
+        except Exception as e:
+            print(f"❌ Failed to send email: {e}")
+    
+    def save_local_backup(self, payload: bytes):
+        """Save results locally as backup"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        route_slug = f"{self.departure_code}_{self.arrival_codes.replace(',', '_')}"
+        filename = f"flight_monitor_{route_slug}_{timestamp}.json"
         
-        with open(filename, 'w') as f:
-            json.dump(backup_data, f, indent=2)
+        with open(filename, 'wb') as f:
+            f.write(payload)
         
         print(f"💾 Backup saved: {filename}")
         return filename
 
 def main():
     """Main execution function"""
+    parser = argparse.ArgumentParser(description="Configurable automated flight monitor")
+    parser.add_argument('--force-refresh', action='store_true',
+                        help="Ignore cached SerpApi responses and query every date again")
+    args = parser.parse_args()
+    
     print("🤖 Configurable Flight Monitor Starting...")
     print(f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}")
     
     try:
-        # Initialize monitor
-        monitor = ConfigurableFlightMonitor()
-        
-        # Run complete scan
-        results = monitor.run_complete_scan()
-        
-        if not results:
-            print("❌ No results found - sending alert email")
-            # Could send alert email here
-            return
-        
-        # Analyze results
-        analysis = monitor.analyze_results(results)
-        
-        # Save local backup
-        backup_file = monitor.save_local_backup(results, analysis)
-        
-        # Send email report
-        monitor.send_email_report(results, analysis)
-        
-        print("\n" + "="*60)
-        print("✅ CONFIGURABLE FLIGHT MONITOR COMPLETE")
-        route_display = f"{monitor.departure_city} → {monitor.arrival_city}"
-        print(f"📊 Route: {route_display}")
-        print(f"✈️  Found {len(results)} options, best: ${analysis['price_min']} {monitor.currency}")
-        print(f"📧 Email report sent to {monitor.email_to}")
-        print(f"💾 Backup saved: {backup_file}")
-        print(f"📞 API calls used: {monitor.api_calls_used}/250 monthly")
+        # Initialize monitor - the context manager releases its HTTP and cache handles
+        with ConfigurableFlightMonitor(force_refresh=args.force_refresh) as monitor:
+            # Run complete scan
+            results = monitor.run_complete_scan()
+            
+            if not results:
+                print("❌ No results found - sending alert email")
+                # Could send alert email here
+                return
+            
+            # Analyze results
+            analysis = monitor.analyze_results(results)
+            
+            # Serialize once for both the backup and the email attachment
+            payload = monitor.build_payload(results, analysis)
+            
+            # Save local backup and send email report - independent, so overlap them
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                backup_future = executor.submit(monitor.save_local_backup, payload)
+                email_future = executor.submit(monitor.send_email_report, results, analysis, payload)
+                backup_file = backup_future.result()
+                email_future.result()
+            
+            print("\n" + "="*60)
+            print("✅ CONFIGURABLE FLIGHT MONITOR COMPLETE")
+            route_display = f"{monitor.departure_city} → {monitor.arrival_city}"
+            print(f"📊 Route: {route_display}")
+            print(f"✈️  Found {len(results)} options, best: ${analysis['price_min']} {monitor.currency}")
+            print(f"📧 Email report sent to {monitor.email_to}")
+            print(f"💾 Backup saved: {backup_file}")
+            print(f"📞 API calls used: {monitor.api_calls_used}/250 monthly")
         
     except Exception as e:
         print(f"❌ Error in automated monitor: {e}")
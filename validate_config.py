@@ -20,6 +20,7 @@ def validate_config():
         return False
     
     load_dotenv('config.env')
+    env = os.environ
     
     # Check required fields
     required_fields = [
@@ -28,25 +29,22 @@ def validate_config():
         'START_MONTH', 'END_MONTH', 'DEPARTURE_DAYS', 'TRIP_DURATION_DAYS'
     ]
     
-    missing_fields = []
-    for field in required_fields:
-        if not os.getenv(field):
-            missing_fields.append(field)
+    missing_fields = [field for field in required_fields if not env.get(field)]
     
     if missing_fields:
         print(f"❌ Missing required fields: {', '.join(missing_fields)}")
         return False
     
     # Validate configuration values
-    departure_city = os.getenv('DEPARTURE_CITY')
-    departure_code = os.getenv('DEPARTURE_CODE')
-    arrival_city = os.getenv('ARRIVAL_CITY')
-    arrival_codes = os.getenv('ARRIVAL_CODES')
+    departure_city = env['DEPARTURE_CITY']
+    departure_code = env['DEPARTURE_CODE']
+    arrival_city = env['ARRIVAL_CITY']
+    arrival_codes = env['ARRIVAL_CODES']
     
-    start_month = int(os.getenv('START_MONTH', 1))
-    end_month = int(os.getenv('END_MONTH', 12))
-    departure_days = os.getenv('DEPARTURE_DAYS', '2,3')
-    trip_duration = int(os.getenv('TRIP_DURATION_DAYS', 4))
+    start_month = int(env['START_MONTH'])
+    end_month = int(env['END_MONTH'])
+    departure_days = env['DEPARTURE_DAYS']
+    trip_duration = int(env['TRIP_DURATION_DAYS'])
     
     print(f"✅ Route: {departure_city} ({departure_code}) → {arrival_city} ({arrival_codes})")
     print(f"✅ Travel Period: Month {start_month} to {end_month}")
@@ -73,6 +71,16 @@ def validate_config():
         print("❌ ERROR: Trip duration should be 1-30 days")
         return False
     
+    # Validate pruning ratio
+    try:
+        prune_ratio = float(env.get('PRUNE_PRICE_RATIO', 0))
+    except ValueError:
+        print("❌ ERROR: PRUNE_PRICE_RATIO must be a number (e.g., '1.5')")
+        return False
+    if prune_ratio and prune_ratio < 1:
+        print("❌ ERROR: PRUNE_PRICE_RATIO must be 0 (off) or at least 1")
+        return False
+    
     # Airport code validation
     if len(departure_code) != 3:
         print(f"⚠️  WARNING: '{departure_code}' doesn't look like a standard airport code")
@@ -85,19 +93,19 @@ def validate_config():
     # Estimate API usage
     print("\n📊 Estimated API Usage:")
     
-    # Calculate date range
-    if start_month <= end_month:
-        month_count = end_month - start_month + 1
-    else:
-        month_count = (12 - start_month + 1) + end_month
-    
-    # Rough estimation: ~4 weeks per month, departure days count
-    estimated_dates = month_count * 4 * len(days)
-    print(f"   Estimated dates to search: ~{estimated_dates}")
+    # Count the exact dates the monitor will search, using its own generator - imported
+    # here so the checks above don't pay for loading requests
+    from automated_flight_monitor import compute_weekend_dates
+    travel_year = int(env.get('TRAVEL_YEAR', 2026))
+    estimated_dates = len(compute_weekend_dates(travel_year, start_month, end_month, tuple(days), trip_duration))
+    print(f"   Dates to search: {estimated_dates}")
     print(f"   API calls per run: ~{estimated_dates}")
     print(f"   Monthly quota usage (7 runs): ~{estimated_dates * 7}")
     
-    if estimated_dates * 7 > 250:
+    if estimated_dates == 0:
+        print("⚠️  WARNING: No departure dates fall inside this month range")
+        print("   (START_MONTH must not be after END_MONTH - ranges can't wrap into the next year)")
+    elif estimated_dates * 7 > 250:
         print("⚠️  WARNING: High quota usage! Consider:")
         print("   - Narrowing date range (fewer months)")
         print("   - Fewer departure days")